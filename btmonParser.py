@@ -2,16 +2,58 @@
 
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 import logging
+import mmap
+import os
 from pathlib import Path
+import stat
 import sys
 from tabulate import tabulate, tabulate_formats
-import re
 
 
 logger = logging.getLogger(__name__)
 
+_RSSI_UNKNOWN = -5000
+_RSSI_MIN = -255
+# HCI RSSI readings range up to +20 dBm, 127 means no reading was available
+_RSSI_MAX = 20
+_FIELD_MAC = 0
+_FIELD_NAME = 1
+_FIELD_COMPANY = 2
+_FIELD_RSSI = 3
+# Maps the first byte of a body line to the only field prefix it can start
+_FIELD_PREFIXES = {
+    b"A": (b"Address: ", _FIELD_MAC),
+    b"L": (b"LE Address: ", _FIELD_MAC),
+    b"B": (b"BR/EDR Address: ", _FIELD_MAC),
+    b"N": (b"Name (complete): ", _FIELD_NAME),
+    b"C": (b"Company: ", _FIELD_COMPANY),
+    b"R": (b"RSSI: ", _FIELD_RSSI)
+}
+
+
+class _Device():
+    """Bluetooth device record"""
+
+    __slots__ = ("firstTime", "lastTime", "name", "manufacturer", "rssi")
+
+    def __init__(self, timestamp: float | datetime, name: str,
+                 manufacturer: str, rssi: int) -> None:
+        """Initialises a bluetooth device record
+        @param timestamp: Timestamp the device was first seen at
+        @param name: Name of device
+        @param manufacturer: Manufacturer of device
+        @param rssi: RSSI of device
+        """
+        self.firstTime = timestamp
+        self.lastTime = timestamp
+        self.name = name
+        self.manufacturer = manufacturer
+        self.rssi = rssi
+
 
 class BtmonParser():
     """Btmon parser object"""
@@ -20,6 +62,8 @@ class BtmonParser():
         """Initialises a btmon parser object"""
         self.devices = {}
         self.reportedDevices = 0
+        # Shared copies of repeated names and manufacturers
+        self._strings = {}
         logger.debug("Btmon parser initialised")
 
     def _addDeviceRecord(self, timestamp: str, mac: str, name: str,
@@ -41,39 +85,41 @@ class BtmonParser():
                 timestamp = datetime.strptime(timestamp, "%H:$M:%S.%f")
             except:
                 timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
-        rssi = int(rssi) if rssi else 5000
-        if mac in self.devices:
-            if timestamp < self.devices[mac]["firstTime"]:
-                self.devices[mac]["firstTime"] = timestamp
-            elif timestamp > self.devices[mac]["lastTime"]:
-                self.devices[mac]["lastTime"] = timestamp
-            if not self.devices[mac]["name"]:
-                self.devices[mac]["name"] = name
-            if not self.devices[mac]["manufacturer"]:
-                self.devices[mac]["manufacturer"] = manufacturer
-            if abs(rssi) < abs(self.devices[mac]["rssi"]):
-                self.devices[mac]["rssi"] = rssi
+        rssi = int(rssi) if rssi else _RSSI_UNKNOWN
+        if rssi > _RSSI_MAX:
+            rssi = _RSSI_UNKNOWN
+        strings = self._strings
+        rec = self.devices.get(mac)
+        if rec is not None:
+            if timestamp < rec.firstTime:
+                rec.firstTime = timestamp
+            elif timestamp > rec.lastTime:
+                rec.lastTime = timestamp
+            if not rec.name:
+                rec.name = strings.setdefault(name, name)
+            if not rec.manufacturer:
+                rec.manufacturer = strings.setdefault(manufacturer,
+                                                      manufacturer)
+            if rssi > rec.rssi:
+                rec.rssi = rssi
         else:
-            self.devices[mac] = {
-                "firstTime": timestamp,
-                "lastTime": timestamp,
-                "name": name,
-                "manufacturer": manufacturer,
-                "rssi": rssi
-            }
+            self.devices[mac] = _Device(timestamp,
+                                        strings.setdefault(name, name),
+                                        strings.setdefault(manufacturer,
+                                                           manufacturer),
+                                        rssi)
 
     def _yesNo(self, prompt: str) -> bool:
         """Prompts the user for a yes/no response
         @param prompt: Prompt to display to the user
         @return: True if yes, False if no
         """
-        yn = input(f"{prompt} (y/n): ")
-        if yn.lower() == 'y':
-            return True
-        elif yn.lower() == 'n':
-            return False
-        else:
-            return self._yesNo(prompt)
+        while True:
+            yn = input(f"{prompt} (y/n): ").lower()
+            if yn == 'y':
+                return True
+            elif yn == 'n':
+                return False
 
     def parse(self, file: Path) -> None:
         """Parses an input file
@@ -81,56 +127,106 @@ class BtmonParser():
         """
         file = file.resolve()
         logger.debug(f"Initiated parsing of input file '{file}'")
+        addDeviceRecord = self._addDeviceRecord
+        getFieldPrefix = _FIELD_PREFIXES.get
         try:
-            with file.open('r', errors="replace") as f:
-                timestamp = ""
-                mac = ""
-                name = ""
-                manufacturer = ""
-                rssi = ""
-                for line in f.readlines():
-                    line = line.rstrip()
-                    if re.match(r'^\S', line):
-                        self._addDeviceRecord(timestamp, mac, name,
-                                              manufacturer, rssi)
-                        timestamp = ""
-                        mac = ""
-                        name = ""
-                        manufacturer = ""
-                        rssi = ""
-                        check = re.search(r'] (.+?)$', line)
-                        if check is not None:
-                            timestamp = check.group(1)
-                            continue
+            with file.open('rb') as f, ExitStack() as stack:
+                info = os.fstat(f.fileno())
+                if stat.S_ISREG(info.st_mode) and info.st_size:
+                    mm = stack.enter_context(
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                    lines = iter(mm.readline, b"")
+                else:
+                    # FIFOs, pipes and empty files cannot be mapped
+                    lines = f
+                # Fields are kept as bytes and only decoded once per record
+                timestamp = b""
+                mac = b""
+                name = b""
+                manufacturer = b""
+                rssi = b""
+                for line in lines:
+                    # Header lines start with a printable, non-space byte
+                    if line[0] > 0x20:
+                        # Most events carry no address, skip the call for them
+                        if mac:
+                            addDeviceRecord(
+                                timestamp.decode(errors="replace"),
+                                mac.decode(errors="replace"),
+                                name.decode(errors="replace"),
+                                manufacturer.decode(errors="replace"),
+                                rssi.decode(errors="replace"))
+                        timestamp = b""
+                        mac = b""
+                        name = b""
+                        manufacturer = b""
+                        rssi = b""
+                        start = line.rfind(b"] ")
+                        if start != -1:
+                            timestamp = line[start + 2:].rstrip()
                     else:
-                        line = line.lstrip()
-                        # MAC
-                        check = re.match(r'^((LE )|(BR/EDR ))?Address: (.+?) ',
-                                        line)
-                        if check is not None:
-                            mac = check.group(4)
-                            continue
-                        # Name
-                        check = re.match(r'^Name \(complete\): (.+?)$', line)
-                        if check is not None:
-                            name = check.group(1)
+                        line = line.strip()
+                        entry = getFieldPrefix(line[:1])
+                        if entry is None or not line.startswith(entry[0]):
                             continue
-                        # Manufacturer
-                        check = re.match(r'^Company: (.+?) \((.+?)\)$', line)
-                        if check is not None:
-                            manufacturer = check.group(1)
-                            continue
-                        # RSSI
-                        check = re.match(r'^RSSI: (.+?) dBm', line)
-                        if check is not None:
-                            rssi = check.group(1)
-                            continue
-        except:
+                        value = line[len(entry[0]):]
+                        field = entry[1]
+                        if field == _FIELD_MAC:
+                            mac = value.split(b" ", 1)[0]
+                        elif field == _FIELD_NAME:
+                            name = value
+                        elif field == _FIELD_COMPANY:
+                            end = value.find(b" (", 1)
+                            if end != -1 and value.endswith(b")"):
+                                manufacturer = value[:end]
+                        else:
+                            value, sep, _ = value.partition(b" dBm")
+                            if sep:
+                                rssi = value
+        except (OSError, ValueError) as e:
             error = "Could not parse file"
-            logger.error(error)
-            raise Warning(error)
+            logger.error(f"{error}: {e}")
+            raise Warning(error) from e
+        except TypeError as e:
+            # float and datetime timestamps cannot be compared
+            error = "Could not parse file, timestamp format differs from " + \
+                "previously parsed files"
+            logger.error(f"{error}: {e}")
+            raise Warning(error) from e
         logger.debug(f"Parsing complete")
 
+    def merge(self, devices: dict) -> None:
+        """Merges device records parsed by another btmon parser object
+        @param devices: Device records to merge, keyed by MAC address
+        """
+        strings = self._strings
+        for mac, other in devices.items():
+            rec = self.devices.get(mac)
+            if rec is None:
+                other.name = strings.setdefault(other.name, other.name)
+                other.manufacturer = strings.setdefault(other.manufacturer,
+                                                        other.manufacturer)
+                self.devices[mac] = other
+                continue
+            try:
+                if other.firstTime < rec.firstTime:
+                    rec.firstTime = other.firstTime
+                if other.lastTime > rec.lastTime:
+                    rec.lastTime = other.lastTime
+            except TypeError as e:
+                # float and datetime timestamps cannot be compared
+                error = "Could not merge devices, timestamp formats differ " + \
+                    "between files"
+                logger.error(f"{error}: {e}")
+                raise Warning(error) from e
+            if not rec.name:
+                rec.name = strings.setdefault(other.name, other.name)
+            if not rec.manufacturer:
+                rec.manufacturer = strings.setdefault(other.manufacturer,
+                                                      other.manufacturer)
+            if other.rssi > rec.rssi:
+                rec.rssi = other.rssi
+
     def report(self, outFile: Path, minRssi: int, format: str = "github",
                overwrite: bool = False) -> None:
         """Generates ouput files
@@ -152,30 +248,20 @@ class BtmonParser():
             with outFile.open('w') as f:
                 headings = ["MAC Address", "First Time", "Last Time",
                             "Common Name", "Manufacturer", "RSSI"]
-                rows = []
-                for mac in self.devices.keys():
-                    if minRssi is not None and self.devices[mac]['rssi'] > 255:
-                        continue
-                    minRssi = -5000 if minRssi is None else minRssi
-                    if self.devices[mac]['rssi'] >= minRssi:
-                        row = [mac]
-                        row.append(self.devices[mac]["firstTime"])
-                        row.append(self.devices[mac]["lastTime"])
-                        if self.devices[mac]["name"]:
-                            row.append(self.devices[mac]["name"])
-                        else:
-                            row.append(mac)
-                        if self.devices[mac]["manufacturer"]:
-                            row.append(self.devices[mac]["manufacturer"])
-                        else:
-                            row.append("Unknown")
-                        row.append(self.devices[mac]['rssi'])
-                        rows.append(row)
-                        self.reportedDevices += 1
-                rows.sort(key=lambda x: (x[-1], x[0]))
-                for row in rows:
-                    if row[-1] > 255:
-                        row[-1] = "Unknown"
+                if minRssi is None:
+                    minRssi = _RSSI_UNKNOWN
+                else:
+                    minRssi = max(minRssi, _RSSI_MIN)
+                # Strongest signal first, the unknown sentinel sorts last
+                devices = sorted(((mac, d) for mac, d in self.devices.items()
+                                  if d.rssi >= minRssi),
+                                 key=lambda item: (-item[1].rssi, item[0]))
+                self.reportedDevices += len(devices)
+                # Tabulate copies its input, so rows are handed over lazily
+                rows = ((mac, d.firstTime, d.lastTime, d.name or mac,
+                         d.manufacturer or "Unknown",
+                         d.rssi if d.rssi >= _RSSI_MIN else "Unknown")
+                        for mac, d in devices)
                 f.write(tabulate(rows, headings, format))
                 logger.debug(f"Bluetooth device report written to '{outFile}'")
         except:
@@ -192,6 +278,38 @@ class BtmonParser():
         f"Bluetooth devices included in report: {self.reportedDevices}"
 
 
+def _configureLogging() -> None:
+    """Configures logging to stdout"""
+    logHandlerStdout = logging.StreamHandler(sys.stdout)
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(levelname)-7s - " +
+                "%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[logHandlerStdout]
+    )
+
+
+def _initWorker(parser: BtmonParser) -> None:
+    """Initialises a worker process for parsing input files
+    @param parser: Empty btmon parser object to parse files with
+    """
+    global _workerParser
+    # Only fork start methods inherit the parent's logging configuration
+    _configureLogging()
+    _workerParser = parser
+
+
+def _parseFile(file: Path) -> dict:
+    """Parses a single input file, for use in a worker process
+    @param file: File to parse
+    @return: Device records found in the file, keyed by MAC address
+    """
+    _workerParser.devices = {}
+    _workerParser.parse(file)
+    return _workerParser.devices
+
+
 def genArgParser() -> argparse.ArgumentParser:
     """Generates a CLI argument parser
     @return: CLI argument parser object
@@ -219,18 +337,22 @@ def main(cliArgs: list = sys.argv[1:]) -> None:
         genArgParser().print_usage()
         sys.exit()
     try:
-        logHandlerStdout = logging.StreamHandler(sys.stdout)
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(asctime)s - %(levelname)-7s - " +
-                    "%(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-            handlers=[logHandlerStdout]
-        )
+        _configureLogging()
         args = genArgParser().parse_args(cliArgs)
         bp = BtmonParser()
-        for file in args.inputFiles:
-            bp.parse(file)
+        workers = min(len(args.inputFiles), os.process_cpu_count() or 1)
+        if workers > 1:
+            # Files are independent, so parse them in parallel and merge the
+            # results in input order. Workers are handed the still empty
+            # parser, so collect every result before merging into it
+            with ProcessPoolExecutor(workers, initializer=_initWorker,
+                                     initargs=(bp,)) as pool:
+                results = list(pool.map(_parseFile, args.inputFiles))
+            for devices in results:
+                bp.merge(devices)
+        else:
+            for file in args.inputFiles:
+                bp.parse(file)
         bp.report(args.outFile, args.rssiMin, args.format, args.noPrompt)
         print("\nParsing complete!\n", bp.summarise(), "", sep="\n")
     except Warning: